@@ -1,6 +1,8 @@
 #! /usr/bin/env python3
 
+import os
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 
@@ -8,28 +10,42 @@ from . import power_rankings
 from . import rank_functions
 
 
+def file_season_metrics(base_filename, yr):
+    df = power_rankings.get_inputs("{}{}.html".format(base_filename, yr), yr)
+    start_week = 1
+    end_week = rank_functions.most_recent_week(df)
+    return rank_functions.season_metrics(df, start_week, end_week)
+
+
 @click.command()
 @click.argument("base_filename")
 @click.argument("start_year", type=int)
 @click.argument("end_year", default=2020)
 def main(base_filename, start_year, end_year):
-    rfs = {
-        "Expected Wins": rank_functions.expected_wins,
-        "Luck Wins": rank_functions.luck_rankings,
-        "Wins": rank_functions.get_wins,
-        "Points For": rank_functions.points_for,
+    metrics = {
+        "Expected Wins": "expected_wins",
+        "Luck Wins": "luck",
+        "Wins": "wins",
+        "Points For": "points_for",
     }
-    rfTitles = list(rfs.keys())
-    counters = {title: Counter() for title in rfTitles}
-
-    for yr in range(start_year, end_year + 1):
-        df = power_rankings.get_inputs("{}{}.html".format(base_filename, yr))
-        start_week = 1
-        end_week = rank_functions.most_recent_week(df)
-        for title, rf in rfs.items():
-            results = rf(df, start_week, end_week)
-            for p in results:
-                counters[title][p] += results[p]
+    counters = {title: Counter() for title in metrics}
+
+    years = range(start_year, end_year + 1)
+    if len(years) > 1:
+        # seasons are independent, so parse and rank them in parallel; map
+        # keeps them in year order so the totals add up the same way every run
+        num_workers = min(len(years), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            season_results = list(
+                executor.map(file_season_metrics, [base_filename] * len(years), years)
+            )
+    else:
+        season_results = [file_season_metrics(base_filename, yr) for yr in years]
+
+    for results in season_results:
+        for title, name in metrics.items():
+            for p, val in results[name].items():
+                counters[title][p] += val
 
     for title, counter in counters.items():
         print(("{} Rankings:".format(title)))
@@ -1,108 +1,227 @@
+import functools
+import hashlib
+import os
+import pickle
 import re
-from collections import Counter
+import tempfile
 
 import click
 import numpy as np
-import pandas as pd
-from pyquery import PyQuery as pq
 
 from power_rankings import rank_functions
 
 NUM_WEEKS = 13
 NUM_TEAMS = 12
+YEAR_RE = re.compile(r"(20\d{2})")
+WHITESPACE_RE = re.compile(r"\s+")
+# (tag, class) of the enclosing elements of a matchup row, innermost first
+MATCHUP_ROW_ANCESTORS = (("tbody", None), ("table", "Table"), ("div", "matchup--table"))
+# bump whenever parsing changes so that schedules cached on disk are reparsed
+CACHE_VERSION = 2
+CACHE_DIR_ENV = "POWER_RANKINGS_CACHE_DIR"
 
 
-def get_inputs(fn):
-    with open(fn) as f:
-        html = f.read()
-
-    doc = pq(html)
-    table = doc("div.matchup--table table.Table")
-    trs = table("tbody tr")
-    trs = [tr for tr in list(trs.items()) if len(tr("td")) == 6]
-    trs = trs[: int(NUM_TEAMS * NUM_WEEKS / 2)]
-    weeks = np.split(np.array(trs, dtype=object), NUM_WEEKS)
-    raw_info = [
-        [
-            {
-                "away": re.sub(r'\s+', ' ', td[1].item().text_content().strip()),
-                "away_score_str": td[2].item().text_content(),
-                "home_score_str": td[3].item().text_content(),
-                "home": re.sub(r'\s+', ' ', td[4].item().text_content().strip()),
-            }
-            for tr in week
-            for td in tr
-        ]
-        for week in weeks
-    ]
-    matchups = [
-        [(matchup["away"], matchup["home"]) for matchup in week] for week in raw_info
-    ]
-    scores = [
+def _in_matchup_table(tr):
+    ancestors = iter(MATCHUP_ROW_ANCESTORS)
+    tag, cls = next(ancestors)
+    for elem in tr.iterancestors():
+        if elem.tag == tag and (cls is None or cls in elem.get("class", "").split()):
+            tag, cls = next(ancestors, (None, None))
+            if tag is None:
+                return True
+    return False
+
+
+def _cell_text(td):
+    # cells are almost always a single text leaf, possibly wrapped in a span or
+    # link, so read that text directly instead of joining every descendant;
+    # surrounding whitespace is dropped here since callers strip it anyway.
+    # Only element children are descended into, since comments and processing
+    # instructions keep their content in .text but contribute no cell text
+    elem = td
+    while len(elem) == 1 and not (elem.text or "").strip():
+        if not isinstance(elem[0].tag, str) or (elem[0].tail or "").strip():
+            break
+        elem = elem[0]
+    if len(elem) == 0:
+        return elem.text or ""
+    return "".join(elem.itertext())
+
+
+def _matchup_rows(fn, max_rows):
+    """Streams the matchup table rows of the HTML file, yielding the text of
+    each row's cells. Rows are cleared once read so that only a small part of
+    the document is held in memory."""
+    from lxml import etree
+
+    num_rows = 0
+    with open(fn, "rb") as f:
+        for _, tr in etree.iterparse(f, tag="tr", html=True, encoding="utf-8"):
+            if len(tr.findall(".//td")) == 6 and _in_matchup_table(tr):
+                yield [_cell_text(td) for td in tr.findall("td")]
+                num_rows += 1
+                if num_rows == max_rows:
+                    return
+            tr.clear()
+            while tr.getprevious() is not None:
+                del tr.getparent()[0]
+
+
+def get_inputs(fn, year=None):
+    """Reads the season's results from the schedule HTML file into a DataFrame
+    with one row per team per week. The season's year is taken from the
+    filename unless given. Parsed files are cached, in memory and on disk (see
+    _cache_dir), until they are modified."""
+    if year is None:
+        yrMatch = YEAR_RE.search(fn)
+        year = int(yrMatch.group(1)) if yrMatch else np.nan
+    path = os.path.abspath(fn)
+    return _load_inputs(path, os.path.getmtime(path), year).copy()
+
+
+@functools.lru_cache(maxsize=64)
+def _load_inputs(path, mtime, year):
+    df = _cached_schedule(path, mtime)
+    df["year"] = year
+    return df
+
+
+def _cache_dir():
+    """Returns the directory parsed schedules are pickled into, taken from the
+    POWER_RANKINGS_CACHE_DIR environment variable and defaulting to
+    power_rankings in the user's cache directory. Setting the variable to an
+    empty string turns the disk cache off, in which case None is returned."""
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir is None:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        cache_dir = os.path.join(base, "power_rankings")
+    return cache_dir or None
+
+
+def _cached_schedule(path, mtime):
+    """Loads the parsed schedule from its pickle in the cache directory. The
+    HTML is parsed again, and the pickle rewritten, when the pickle is missing
+    or was saved from a different version of the file, of the parser, or of
+    pandas or numpy. The cache directory may be shared between environments,
+    so any failure to load the pickle counts as a miss."""
+    import pandas as pd
+
+    cache_dir = _cache_dir()
+    if cache_dir is None:
+        return _parse_schedule(path)
+    key = (
+        CACHE_VERSION,
+        NUM_TEAMS,
+        NUM_WEEKS,
+        pd.__version__,
+        np.__version__,
+        path,
+        mtime,
+    )
+    cache_path = os.path.join(
+        cache_dir, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".pkl"
+    )
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, df = pickle.load(f)
+        if cached_key == key:
+            return df
+    except Exception:
+        # a missing or unreadable cache is simply rebuilt; this includes
+        # pickles from other library versions that fail to import or unpack
+        pass
+    df = _parse_schedule(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file and move it into place so that a run
+        # reading the cache at the same time never sees a partial pickle
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((key, df), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except OSError:
+        pass
+    return df
+
+
+def _parse_schedule(path):
+    import pandas as pd
+
+    rows = list(_matchup_rows(path, int(NUM_TEAMS * NUM_WEEKS / 2)))
+    games_per_week = NUM_TEAMS // 2
+    num_rows = 2 * len(rows)
+    week_col = [0] * num_rows
+    team_col = [""] * num_rows
+    opp_col = [""] * num_rows
+    score_col = [0.0] * num_rows
+    opp_score_col = [0.0] * num_rows
+    for i, tds in enumerate(rows):
+        away = WHITESPACE_RE.sub(" ", tds[1].strip())
+        home = WHITESPACE_RE.sub(" ", tds[4].strip())
+        away_score_str = tds[2].strip()
+        home_score_str = tds[3].strip()
+        away_score = float(away_score_str) if away_score_str else 0.0
+        home_score = float(home_score_str) if home_score_str else 0.0
+        # one row for the away team followed by one for the home team
+        for row, team, opp, score, opp_score in (
+            (2 * i, away, home, away_score, home_score),
+            (2 * i + 1, home, away, home_score, away_score),
+        ):
+            week_col[row] = i // games_per_week + 1
+            team_col[row] = team
+            opp_col[row] = opp
+            score_col[row] = score
+            opp_score_col[row] = opp_score
+    df = pd.DataFrame(
         {
-            team: float(score_str) if score_str else 0.0
-            for matchup in week
-            for (team, score_str) in [
-                (matchup["away"], matchup["away_score_str"]),
-                (matchup["home"], matchup["home_score_str"]),
-            ]
+            "week": np.asarray(week_col, dtype=np.int8),
+            "team": team_col,
+            "opponent": opp_col,
+            "score": np.asarray(score_col, dtype=np.float64),
+            "oppScore": np.asarray(opp_score_col, dtype=np.float64),
         }
-        for week in raw_info
-    ]
-    dicts = []
-    for i, (mu, score) in enumerate(zip(matchups, scores)):
-        for p1, p2 in mu:
-            d1 = {
-                "week": i + 1,
-                "team": p1,
-                "opponent": p2,
-                "score": score[p1],
-                "oppScore": score[p2],
-            }
-            d2 = {
-                "week": i + 1,
-                "team": p2,
-                "opponent": p1,
-                "score": score[p2],
-                "oppScore": score[p1],
-            }
-            dicts.extend([d1, d2])
-    df = pd.DataFrame(dicts)
-
-    def wins_func(t, o):
-        """Two arguments are team and opponent scores. Returns 1 if team won,
-        0.5 if tied, 0 if team lost."""
-        return 1.0 * (t > o) + 0.5 * (t == o) if t + o > 0.0 else 0.0
-
-    df["wins"] = [wins_func(score, opp) for score, opp in zip(df.score, df.oppScore)]
-    yrMatch = re.search(r"(20\d{2})", fn)
-    year = int(yrMatch.group(1)) if yrMatch else np.nan
-    df["year"] = year
+    )
+
+    # 1 if team won, 0.5 if tied, 0 if team lost or the game hasn't been played
+    t = df["score"].to_numpy()
+    o = df["oppScore"].to_numpy()
+    df["wins"] = np.where(t + o > 0.0, 1.0 * (t > o) + 0.5 * (t == o), 0.0)
     return df
 
 
 def ranking_strings(df, rfs, start_week, end_week):
-    year = df.year.unique().item()
-    retStr = "{} Power Rankings: Weeks {}-{}\n".format(year, start_week, end_week)
-    retStr += "=" * len(retStr) + "\n"
+    # get_inputs fills the whole year column with the same value
+    year = df.year.iloc[0]
+    header = "{} Power Rankings: Weeks {}-{}\n".format(year, start_week, end_week)
+    parts = [header, "=" * len(header) + "\n"]
     for title, rf, sort_rf in rfs:
-        ranks = Counter(rf(df, start_week, end_week))
+        ranks = rf(df, start_week, end_week)
         if sort_rf:
             sort_ranks = sort_rf(df, start_week, end_week)
             ordering = sorted(
-                sort_ranks, key=lambda x: (ranks[x], sort_ranks[x]), reverse=True
+                sort_ranks, key=lambda x: (ranks.get(x, 0), sort_ranks[x]), reverse=True
             )
-            ordered = [(team, ranks[team]) for team in ordering]
+            ordered = [(team, ranks.get(team, 0)) for team in ordering]
         else:
-            ordered = ranks.most_common()
-        retStr += "{} Rankings:\n".format(title)
+            teams = list(ranks)
+            values = np.array([ranks[team] for team in teams])
+            ordered = [
+                (teams[i], values[i]) for i in np.argsort(-values, kind="stable")
+            ]
+        parts.append("{} Rankings:\n".format(title))
         for (i, (name, val)) in enumerate(ordered):
             if isinstance(val, int) or isinstance(val, float):
-                retStr += "{:>2}. {:25}{: .3f}\n".format(i + 1, name, val)
+                parts.append("{:>2}. {:25}{: .3f}\n".format(i + 1, name, val))
             else:
-                retStr += "{:>2}. {:25}{}\n".format(i + 1, name, val)
-        retStr += "\n"
-    return retStr
+                parts.append("{:>2}. {:25}{}\n".format(i + 1, name, val))
+        parts.append("\n")
+    return "".join(parts)
 
 
 @click.command()
@@ -1,107 +1,160 @@
-from collections import Counter, defaultdict
+from collections import namedtuple
 
 import numpy as np
-import pandas as pd
+
+
+SeasonArrays = namedtuple("SeasonArrays", ["teams", "scores", "opp_scores"])
+
+
+def get_teams(df):
+    """Returns the frame's teams in order of first appearance."""
+    return tuple(df.team.unique())
+
+
+def _slice_weeks(df, start_week, end_week):
+    weeks = df.week.to_numpy()
+    return df[(start_week <= weeks) & (weeks <= end_week)]
+
+
+def season_arrays(df, start_week, end_week):
+    """Pivots the given weeks into (weeks x teams) matrices of each team's score
+    and its opponent's score. Columns follow the order of `teams`."""
+    players = get_teams(df)
+    df = _slice_weeks(df, start_week, end_week)
+    if df.empty:
+        # no weeks in the range, e.g. before the season's first game
+        empty = np.zeros((0, len(players)))
+        return SeasonArrays(teams=players, scores=empty, opp_scores=empty)
+    wide = df.pivot(index="week", columns="team", values=["score", "oppScore"])
+    scores = wide["score"].reindex(columns=list(players)).to_numpy()
+    opp_scores = wide["oppScore"].reindex(columns=list(players)).to_numpy()
+    if np.isnan(scores).any() or np.isnan(opp_scores).any():
+        raise ValueError(
+            "Every team needs a score in each of weeks {}-{}".format(
+                start_week, end_week
+            )
+        )
+    return SeasonArrays(teams=players, scores=scores, opp_scores=opp_scores)
 
 
 def most_recent_week(df):
-    earliestFuture = df.week.max() + 1
-    for wk, group in df.groupby("week"):
-        if wk < earliestFuture and not group.score.any():
-            earliestFuture = wk
+    weeks = df.week.to_numpy()
+    if not len(weeks):
+        return 0
+    # weeks where every score is still zero haven't been played yet
+    unplayed = np.setdiff1d(weeks, weeks[df.score.to_numpy() != 0])
+    earliestFuture = unplayed.min() if len(unplayed) else weeks.max() + 1
     return earliestFuture - 1
 
 
+def _pairwise_wins(scores):
+    """Takes a (weeks x teams) score matrix and returns, for each team, the
+    number of teams it outscored in the same week summed over all weeks, with
+    ties counting as half a win."""
+    # scores have at most two decimals, so float32 keeps their order and ties
+    scores = scores.astype(np.float32)
+    # compare every team's score to every other team's score in the same week;
+    # the diagonal is always a tie, so drop one tie per team per week
+    diff = scores[:, :, None] - scores[:, None, :]
+    ties = (diff == 0).sum(axis=(0, 2)) - len(scores)
+    return (diff > 0).sum(axis=(0, 2)) + 0.5 * ties
+
+
 def expected_wins(df, start_week, end_week):
-    players = df.team.unique()
-    n = len(players)
-    noLuckWins = Counter({p: 0.0 for p in players})
-    df = df.query("@start_week <= week <= @end_week")
-    for wk, group in df.groupby("week"):
-        for p in players:
-            pScore = group.loc[group.team == p, "score"].values[0]
-            allScores = group.loc[:, ["team", "score"]].values
-            expWins = np.sum(
-                1 * (pScore > score) + 0.5 * (pScore == score)
-                for opp, score in allScores
-                if opp != p
-            )
-            noLuckWins[p] += expWins
+    arrays = season_arrays(df, start_week, end_week)
+    n = len(arrays.teams)
+    expWins = _pairwise_wins(arrays.scores)
 
     # convert to week-per-game wins
-    for p in noLuckWins:
-        noLuckWins[p] /= float(n - 1)
-
-    return noLuckWins
+    return dict(zip(arrays.teams, expWins / float(n - 1)))
 
 
 def week_finishes(df, start_week, end_week):
-    players = df.team.unique()
-    finishes = defaultdict(list)
-    df = df.query("@start_week <= week <= @end_week")
-    for wk, group in df.groupby("week"):
-        group_w_rank = group.assign(rank=group.score.rank(ascending=False))
-        for p in players:
-            finishes[p].append(group_w_rank.loc[group.team == p, "rank"].iloc[0])
-
-    return finishes
+    players = get_teams(df)
+    df = _slice_weeks(df[["week", "team", "score"]], start_week, end_week)
+    df = df.assign(rank=df.groupby("week", sort=False).score.rank(ascending=False))
+    ranks = df.pivot(index="week", columns="team", values="rank")
+    ranks = ranks.reindex(columns=list(players))
+    return {p: ranks[p].tolist() for p in players}
 
 
 def expected_win_pct(df, start_week, end_week):
     expWins = expected_wins(df, start_week, end_week)
-    for p in expWins:
-        expWins[p] /= float(end_week - start_week + 1)
+    num_weeks = float(end_week - start_week + 1)
+    # with no weeks in the range every team is left at 0
+    if num_weeks > 0:
+        for p in expWins:
+            expWins[p] /= num_weeks
     return expWins
 
 
+def _actual_wins(scores, opp_scores):
+    # 1 for a win, 0.5 for a tie, 0 for a loss or a game that hasn't been played
+    return np.where(
+        scores + opp_scores > 0.0,
+        1.0 * (scores > opp_scores) + 0.5 * (scores == opp_scores),
+        0.0,
+    ).sum(axis=0)
+
+
 def get_wins(df, start_week, end_week):
-    df = df.query("@start_week <= week <= @end_week")
-    return dict(df.groupby("team").wins.sum().items())
+    arrays = season_arrays(df, start_week, end_week)
+    return dict(zip(arrays.teams, _actual_wins(arrays.scores, arrays.opp_scores)))
 
 
 def projected_wins(df, start_week, end_week):
-    teams = df.team.unique()
     if start_week != 1:
-        return {tm: np.nan for tm in teams}
-    exp_win_pct = pd.Series(expected_win_pct(df, start_week, end_week))
-    current_wins = pd.Series(get_wins(df, start_week, end_week))
-    num_past_games = end_week
+        return {tm: np.nan for tm in get_teams(df)}
+    metrics = season_metrics(df, start_week, end_week)
     num_future_games = df.week.max() - end_week
-    future_wins = num_future_games * exp_win_pct
-    total_wins = current_wins + future_wins
-    return total_wins.to_dict()
-    total_losses = num_past_games + num_future_games - total_wins
+    num_weeks = float(end_week - start_week + 1)
+    if num_weeks < 1:
+        # nothing has been played, so there is no pace to project from
+        return metrics["wins"]
     return {
-        tm: "{}-{}".format(round(wins, 2), round(loss, 2))
-        for (tm, wins), loss in zip(total_wins.items(), total_losses)
+        tm: wins + num_future_games * (metrics["expected_wins"][tm] / num_weeks)
+        for tm, wins in metrics["wins"].items()
     }
 
 
 def remaining_schedule(df, start_week, end_week):
+    future = df[df.week.to_numpy() > end_week]
+    if future.empty:
+        return {}
     expWins = expected_win_pct(df, start_week, end_week)
-    df = df.query("week > @end_week")
-    weeksLeft = len(df.week.unique())
-    sos = Counter()
-    for team, group in df.groupby("team"):
-        sos[team] = np.sum(expWins[opp] for opp in group.opponent)
-    for p in sos:
-        sos[p] /= float(weeksLeft)
-    return sos
+    weeksLeft = future.week.nunique()
+    sos = future.opponent.map(expWins).groupby(future.team).sum()
+    return (sos / float(weeksLeft)).to_dict()
 
 
 def luck_rankings(df, start_week, end_week):
-    wins = get_wins(df, start_week, end_week)
-    expWins = expected_wins(df, start_week, end_week)
-    players = df.team.unique()
-    luck = Counter()
-    for p in players:
-        luck[p] = wins[p] - expWins[p]
-    return luck
+    return season_metrics(df, start_week, end_week)["luck"]
+
+
+def season_metrics(df, start_week, end_week):
+    """Computes expected wins, actual wins, luck and points for from a single
+    pivot of the given weeks. Returns a dict from each metric's name to a
+    dict of its value by team."""
+    arrays = season_arrays(df, start_week, end_week)
+    expWins = _pairwise_wins(arrays.scores) / float(len(arrays.teams) - 1)
+    wins = _actual_wins(arrays.scores, arrays.opp_scores)
+    metrics = {
+        "expected_wins": expWins,
+        "wins": wins,
+        "luck": wins - expWins,
+        "points_for": arrays.scores.sum(axis=0),
+    }
+    by_team = {
+        name: dict(zip(arrays.teams, values)) for name, values in metrics.items()
+    }
+    # list wins and points for by team name, as points_for does, so that teams
+    # tied in all_time's totals come out in alphabetical order
+    for name in ("wins", "points_for"):
+        by_team[name] = dict(sorted(by_team[name].items()))
+    return by_team
 
 
 def points_for(df, start_week, end_week):
-    points = Counter()
-    df = df.query("@start_week <= week <= @end_week")
-    for k, v in df.groupby("team").score.sum().items():
-        points[k] = v
-    return points
+    teams = sorted(get_teams(df))
+    df = _slice_weeks(df, start_week, end_week)
+    return df.groupby("team").score.sum().reindex(teams, fill_value=0.0).to_dict()